@@ -1,6 +1,5 @@
 import numpy as np
-from tqdm import tqdm
-from msp_tsne.parametric_tsne import ParametricTSNE, x2p
+from msp_tsne.parametric_tsne import ParametricTSNE, d2p, squared_distances, _finalize_P
 
 
 class MultiscaleParametricTSNE(ParametricTSNE):
@@ -15,6 +14,8 @@ class MultiscaleParametricTSNE(ParametricTSNE):
                 nl1 = 1000,
                 nl2 = 500,
                 nl3 = 250,
+                use_gpu=False,
+                random_state=None,
                 logdir=None, verbose=0):
 
         # Fake perplexity init.
@@ -29,22 +30,23 @@ class MultiscaleParametricTSNE(ParametricTSNE):
                          nl1 = nl1,
                          nl2 = nl2,
                          nl3 = nl3,
+                         use_gpu=use_gpu,
+                         random_state=random_state,
                          logdir=logdir, verbose=verbose)
     
     def _calculate_P(self, X):
         # Compute multi-scale Gaussian similarities with exponentially growing perplexities
         n = X.shape[0]
-        P = np.zeros([n, self.batch_size])
+        P = np.zeros([n, self.batch_size], dtype=np.float32)
         H = np.rint(np.log2(n/2))
-        for h in tqdm(np.arange(1, H+1)):
-            # Compute current perplexity P_ij
-            perplexity = 2**h
-            for i in np.arange(0, n, self.batch_size):
-                P_batch = x2p(X[i:i + self.batch_size], perplexity)
-                P_batch[np.isnan(P_batch)] = 0
-                P_batch = P_batch + P_batch.T
-                P_batch = P_batch / P_batch.sum()
-                P_batch = np.maximum(P_batch, 1e-12)
-                P[i:i + self.batch_size] += P_batch
+        for i in self._batch_range(n):
+            # Pairwise distances do not depend on perplexity: compute them once per batch
+            D = squared_distances(X[i:i + self.batch_size])
+            for h in np.arange(1, H+1):
+                # Compute current perplexity P_ij
+                perplexity = 2**h
+                P_batch = d2p(D, perplexity, use_gpu=self.use_gpu)
+                P[i:i + self.batch_size] += _finalize_P(P_batch)
         
-        return P/H      # Average across perplexities
\ No newline at end of file
+        P /= H          # Average across perplexities
+        return P
\ No newline at end of file
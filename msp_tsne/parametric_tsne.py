@@ -2,91 +2,330 @@ import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
 from tqdm import tqdm
+import math
 import numpy as np
 import numba
+from numba import cuda
 
 import sklearn
 from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.metrics.pairwise import euclidean_distances
+from sklearn.neighbors import NearestNeighbors
+from scipy import sparse
 
 import keras.backend as K
 from keras.models import Sequential
 from keras.layers import Dense, InputLayer, Dropout
-from keras.callbacks import TensorBoard
 from keras.optimizers import Adam
 
 import tensorflow as tf
 
-
-@numba.jit(nopython=True, error_model='numpy')          # https://github.com/numba/numba/issues/4360
-def Hbeta(D, beta):
-
-    P = np.exp(-D * beta)
-    sumP = np.sum(P)                                    # ACHTUNG! This could be zero!
-    H = np.log(sumP) + beta * np.sum(D * P) / sumP      # ACHTUNG! Divide-by-zero possible here!
-    P = P / sumP                                        # ACHTUNG! Divide-by-zero possible here!
-    
-    return H, P
+# Fast-math flags without 'nnan'/'ninf' (the bisection relies on infinite beta bounds)
+# and without 'arcp' (x / sumP must not become x * (1 / sumP), which overflows for subnormal sumP)
+_FASTMATH = {'nsz', 'contract', 'afn', 'reassoc'}
+
+# Perplexity search settings, frozen as compile-time constants by numba
+_MAX_ITERATION = 50
+_TOL = 1e-5
+
+@numba.njit(fastmath=_FASTMATH, error_model='numpy')  # https://github.com/numba/numba/issues/4360
+def Hbeta(D, beta, P_out, skip=-1, D_min=0.0):
+
+    # Single fused pass: P, sum(P), sum(D * P) and sum(D^2 * P). Entry 'skip' (the diagonal) is zeroed.
+    # Distances are shifted by 'D_min' (the smallest off-diagonal one): P, H and dH are unchanged,
+    # but the nearest neighbor contributes exp(0) = 1, so sumP >= 1 never underflows.
+    sumP = 0.0
+    sumDP = 0.0
+    sumD2P = 0.0
+    for k in range(D.size):
+        if k == skip:
+            P_out[k] = 0.0
+            continue
+        d = D[k] - D_min
+        v = math.exp(-d * beta)
+        P_out[k] = v
+        sumP += v                                       # ACHTUNG! This could be zero (without the shift)!
+        sumDP += d * v
+        sumD2P += d * d * v
+
+    meanD = sumDP / sumP                                # ACHTUNG! Divide-by-zero possible here!
+    H = math.log(sumP) + beta * meanD
+    # dH/dbeta = -beta * Var_P(D)
+    dH = -beta * (sumD2P / sumP - meanD ** 2)
+    for k in range(D.size):
+        P_out[k] /= sumP
+
+    return H, dH
+
+@numba.njit
+def _bisect(beta, beta_min, beta_max, Hdiff):
+    # Branchless bisection step: every branch is a select, no data-dependent jumps
+    pos = Hdiff > 0
+    beta_min = beta if pos else beta_min
+    beta_max = beta_max if pos else beta
+    up = beta * 2. if np.isinf(beta_max) else (beta + beta_max) / 2.        # Numba compatibility: isposinf --> isinf
+    down = beta / 2. if np.isinf(beta_min) else (beta + beta_min) / 2.      # Numba compatibility: isneginf --> isinf
+    beta = up if pos else down
+
+    return beta, beta_min, beta_max
+
+@numba.njit(error_model='numpy')
+def _newton(beta, beta_min, beta_max, Hdiff, dH):
+    # Newton step on H(beta), falling back to bisection if it leaves the bracket
+    # (or [beta / 4, 4 * beta]). The bisection step also keeps the bracket up to date.
+    bt, beta_min, beta_max = _bisect(beta, beta_min, beta_max, Hdiff)
+    step = beta - Hdiff / dH
+    ok = (dH < 0) & (beta_min < step) & (step < beta_max) & (beta / 4. <= step) & (step <= beta * 4.)
+    beta = step if ok else bt
+
+    return beta, beta_min, beta_max
 
 @numba.jit(nopython=True)
-def x2p_job(data, max_iteration=50, tol=1e-5):
+def x2p_job(data, max_iteration=_MAX_ITERATION, tol=_TOL):
     i, Di, logU = data
     
     beta = 1.0
     beta_min = -np.inf
     beta_max = np.inf
     
-    H, thisP = Hbeta(Di, beta)
+    # Nearest off-diagonal distance, see 'Hbeta'
+    D_min = np.inf
+    for k in range(Di.size):
+        if k != i and Di[k] < D_min:
+            D_min = Di[k]
+    D_min = 0.0 if np.isinf(D_min) else D_min
+
+    # float64 scratch: unnormalized exp(-D * beta) underflows early in float32
+    thisP = np.empty(Di.size, dtype=np.float64)
+    H, dH = Hbeta(Di, beta, thisP, i, D_min)
     Hdiff = H - logU
 
     tries = 0
-    while tries < max_iteration and np.abs(Hdiff) > tol:
+    # 'not <=' keeps searching on a NaN Hdiff (all exp underflowed) instead of stopping
+    while tries < max_iteration and not (np.abs(Hdiff) <= tol):
     
         # If not, increase or decrease precision
-        if Hdiff > 0:
-            beta_min = beta
-            if np.isinf(beta_max):      # Numba compatibility: isposinf --> isinf
-                beta *= 2.
-            else:
-                beta = (beta + beta_max) / 2.
-        else:
-            beta_max = beta
-            if np.isinf(beta_min):      # Numba compatibility: isneginf --> isinf
-                beta /= 2. 
-            else:
-                beta = (beta + beta_min) / 2.
+        beta, beta_min, beta_max = _newton(beta, beta_min, beta_max, Hdiff, dH)
 
-        H, thisP = Hbeta(Di, beta)
+        H, dH = Hbeta(Di, beta, thisP, i, D_min)
         Hdiff = H - logU
         tries += 1
 
     return i, thisP
 
-def x2p(X, perplexity, n_jobs=None):
+@numba.njit(parallel=True, fastmath=_FASTMATH, error_model='numpy')
+def _x2p_all(D, logU, P_out):
+    n = D.shape[0]
+    for i in numba.prange(n):
+        # The diagonal is skipped inside Hbeta, no masking needed
+        _, thisP = x2p_job((i, D[i], logU))
+        P_out[i] = thisP
+
+_CUDA_THREADS = 128     # Threads per block (one block per row), must be a power of 2
+
+@cuda.jit
+def _x2p_kernel(D, logU, P, max_iteration, tol):
+    i = cuda.blockIdx.x
+    tid = cuda.threadIdx.x
+    n = D.shape[1]
+
+    s_sumP = cuda.shared.array(_CUDA_THREADS, numba.float64)
+    s_sumDP = cuda.shared.array(_CUDA_THREADS, numba.float64)
+    s_sumD2P = cuda.shared.array(_CUDA_THREADS, numba.float64)
+    # Search state owned by thread 0: beta, beta_min, beta_max, done
+    s_state = cuda.shared.array(4, numba.float64)
+
+    if tid == 0:
+        s_state[0] = 1.0
+        s_state[1] = -math.inf
+        s_state[2] = math.inf
+        s_state[3] = 0.0
+
+    # Nearest off-diagonal distance (block min-reduction), see 'Hbeta'
+    D_min = math.inf
+    for k in range(tid, n, _CUDA_THREADS):
+        if k != i and D[i, k] < D_min:
+            D_min = D[i, k]
+    s_sumP[tid] = D_min
+    cuda.syncthreads()
+    stride = _CUDA_THREADS // 2
+    while stride > 0:
+        if tid < stride:
+            s_sumP[tid] = min(s_sumP[tid], s_sumP[tid + stride])
+        cuda.syncthreads()
+        stride //= 2
+    D_min = s_sumP[0]
+    D_min = 0.0 if math.isinf(D_min) else D_min
+    cuda.syncthreads()
 
-    n = X.shape[0]
-    logU = np.log(perplexity)
+    tries = 0
+    while True:
+        beta = s_state[0]
+
+        # Strided exp pass, partial sums in registers (P is only written once normalized)
+        sumP = 0.0
+        sumDP = 0.0
+        sumD2P = 0.0
+        for k in range(tid, n, _CUDA_THREADS):
+            if k != i:
+                d = D[i, k] - D_min
+                v = math.exp(-d * beta)
+                sumP += v
+                sumDP += d * v
+                sumD2P += d * d * v
+        s_sumP[tid] = sumP
+        s_sumDP[tid] = sumDP
+        s_sumD2P[tid] = sumD2P
+        cuda.syncthreads()
+
+        # Block reduction
+        stride = _CUDA_THREADS // 2
+        while stride > 0:
+            if tid < stride:
+                s_sumP[tid] += s_sumP[tid + stride]
+                s_sumDP[tid] += s_sumDP[tid + stride]
+                s_sumD2P[tid] += s_sumD2P[tid + stride]
+            cuda.syncthreads()
+            stride //= 2
+
+        if tid == 0:
+            meanD = s_sumDP[0] / s_sumP[0]
+            H = math.log(s_sumP[0]) + beta * meanD
+            dH = -beta * (s_sumD2P[0] / s_sumP[0] - meanD ** 2)
+            Hdiff = H - logU
+            # Same test as 'x2p_job': a NaN Hdiff keeps searching
+            if tries >= max_iteration or abs(Hdiff) <= tol:
+                s_state[3] = 1.0
+            else:
+                # Same update as '_newton': bisection bracket + safeguarded Newton step
+                beta_min = s_state[1]
+                beta_max = s_state[2]
+                if Hdiff > 0:
+                    beta_min = beta
+                    bt = beta * 2. if math.isinf(beta_max) else (beta + beta_max) / 2.
+                else:
+                    beta_max = beta
+                    bt = beta / 2. if math.isinf(beta_min) else (beta + beta_min) / 2.
+                step = beta - Hdiff / dH
+                ok = (dH < 0) and (beta_min < step < beta_max) and (beta / 4. <= step <= beta * 4.)
+                s_state[0] = step if ok else bt
+                s_state[1] = beta_min
+                s_state[2] = beta_max
+        cuda.syncthreads()
+
+        if s_state[3] > 0:
+            break
+        tries += 1
 
-    sum_X = np.sum(np.square(X), axis=1)
-    D = sum_X + (sum_X.reshape((-1, 1)) - 2 * np.dot(X, X.T))
+    # Final pass at the converged beta, normalized in float64 before the store
+    beta = s_state[0]
+    sumP = s_sumP[0]
+    for k in range(tid, n, _CUDA_THREADS):
+        if k == i:
+            P[i, k] = 0.0
+        else:
+            P[i, k] = math.exp(-(D[i, k] - D_min) * beta) / sumP
+
+def _x2p_gpu(D, logU, max_iteration=_MAX_ITERATION, tol=_TOL):
+    n = D.shape[0]
+    d_D = cuda.to_device(D)
+    d_P = cuda.device_array_like(d_D)
+    _x2p_kernel[n, _CUDA_THREADS](d_D, logU, d_P, max_iteration, tol)
+    return d_P.copy_to_host()
+
+def squared_distances(X):
+    # BLAS GEMM expansion, keeps the input dtype (float32 in 'fit')
+    return euclidean_distances(X, squared=True)
+
+def _numba_n_threads(n_jobs):
+    # None keeps the current numba thread count (e.g. set by the caller via numba.set_num_threads).
+    # Negative values follow scikit-learn: -1 means all threads, -2 all but one, ...
+    if n_jobs is None:
+        return numba.get_num_threads()
+    max_threads = numba.config.NUMBA_NUM_THREADS
+    if n_jobs < 0:
+        return max(1, max_threads + 1 + n_jobs)
+    return min(n_jobs, max_threads)
+
+def x2p(X, perplexity, n_jobs=None, use_gpu=False):
+    D = squared_distances(X)
+    return d2p(D, perplexity, n_jobs=n_jobs, use_gpu=use_gpu)
+
+def d2p(D, perplexity, n_jobs=None, use_gpu=False):
+    # Same as 'x2p', from precomputed squared distances (reusable across perplexities)
+    n = D.shape[0]
+    logU = np.float32(np.log(perplexity))      # Loop-invariant scalar for the jitted drivers
+
+    if use_gpu:
+        if not cuda.is_available():
+            raise RuntimeError('use_gpu=True but no CUDA device is available.')
+        return _x2p_gpu(D, logU)
+
+    P = np.empty([n, n], dtype=D.dtype)
+    n_threads = numba.get_num_threads()
+    numba.set_num_threads(_numba_n_threads(n_jobs))
+    try:
+        _x2p_all(D, logU, P)
+    finally:
+        numba.set_num_threads(n_threads)
 
-    idx = (1 - np.eye(n)).astype(bool)
-    D = D[idx].reshape((n, -1))
+    return P
 
-    P = np.zeros([n, n])
-    for i in range(n):
-        P[i, idx[i]] = x2p_job((i,D[i],logU))[1]
+@numba.njit(parallel=True, fastmath=_FASTMATH, error_model='numpy')
+def _finalize_P(P):
+    # In place: nan -> 0, P + P.T, P / sum(P), max(P, 1e-12)
+    n = P.shape[0]
+    s = 0.0
+    for i in numba.prange(n):
+        # Row i owns the pairs (i, j >= i): no two threads touch the same entries
+        v = P[i, i]
+        v = 0.0 if np.isnan(v) else v
+        P[i, i] = 2 * v
+        s += 2 * v
+        for j in range(i + 1, n):
+            a = P[i, j]
+            b = P[j, i]
+            v = (0.0 if np.isnan(a) else a) + (0.0 if np.isnan(b) else b)
+            P[i, j] = v
+            P[j, i] = v
+            s += 2 * v
+
+    inv = 1.0 / s
+    for i in numba.prange(n):
+        for j in range(n):
+            P[i, j] = max(P[i, j] * inv, 1e-12)
 
     return P
 
-def write_log(callback, names, logs, batch_no):
-    for name, value in zip(names, logs):
-        summary = tf.Summary()
-        summary_value = summary.value.add()
-        summary_value.simple_value = value
-        summary_value.tag = name
-        callback.writer.add_summary(summary, batch_no)
-        callback.writer.flush()
+@numba.njit(parallel=True, fastmath=_FASTMATH, error_model='numpy')
+def _x2p_knn_all(Dk, logU, P_out):
+    for i in numba.prange(Dk.shape[0]):
+        # Neighbor lists exclude the point itself, nothing to skip
+        _, thisP = x2p_job((-1, Dk[i], logU))
+        P_out[i] = thisP
 
+def x2p_knn(X, perplexity, n_neighbors=None, n_jobs=None):
+
+    n = X.shape[0]
+    logU = np.float32(np.log(perplexity))
+    if n_neighbors is None:
+        n_neighbors = int(3 * perplexity)
+    k = min(n_neighbors, n - 1)
+
+    # Squared distances to the k nearest neighbors only: O(n * k) instead of O(n^2)
+    nn = NearestNeighbors(n_neighbors=k, n_jobs=n_jobs).fit(X)
+    Dk, idx = nn.kneighbors()
+    Dk = np.square(Dk, dtype=X.dtype)
+
+    Pk = np.empty_like(Dk)
+    n_threads = numba.get_num_threads()
+    numba.set_num_threads(_numba_n_threads(n_jobs))
+    try:
+        _x2p_knn_all(Dk, logU, Pk)
+    finally:
+        numba.set_num_threads(n_threads)
+
+    return sparse.csr_matrix((Pk.ravel(), idx.ravel(), np.arange(0, n * k + 1, k)), shape=(n, n))
 
 class ParametricTSNE(BaseEstimator, TransformerMixin):
 
@@ -101,6 +340,9 @@ class ParametricTSNE(BaseEstimator, TransformerMixin):
                 nl1 = 1000,
                 nl2 = 500,
                 nl3 = 250,
+                use_gpu=False,
+                method='exact',
+                random_state=None,
                 logdir=None, verbose=0):
         
         self.n_components = n_components
@@ -114,6 +356,14 @@ class ParametricTSNE(BaseEstimator, TransformerMixin):
         self.nl2 = nl2
         self.nl3 = nl3
 
+        # Perplexity search on a CUDA device
+        self.use_gpu = use_gpu
+        # P computation: 'exact' (dense) or 'knn' (sparse, 3 * perplexity neighbors)
+        self.method = method
+
+        # Batch shuffling
+        self.random_state = random_state
+
         # Early-exaggeration
         self.early_exaggeration_epochs = early_exaggeration_epochs
         self.early_exaggeration_value = early_exaggeration_value
@@ -129,10 +379,13 @@ class ParametricTSNE(BaseEstimator, TransformerMixin):
 
         # Internals
         self._model = None
+        self._rng = None
         
     def fit(self, X, y=None):
                 
         """fit the model with X"""
+
+        X = np.ascontiguousarray(X, dtype=np.float32)
         
         if self.batch_size is None:
             self.batch_size = X.shape[0]
@@ -154,10 +407,12 @@ class ParametricTSNE(BaseEstimator, TransformerMixin):
         
         # Tensorboard
         if not self.logdir == None:
-            callback = TensorBoard(self.logdir)
-            callback.set_model(self._model)
+            writer = tf.summary.create_file_writer(self.logdir)
         else:
-            callback = None
+            writer = None
+
+        # PCG64 generator for batch shuffling
+        self._rng = np.random.default_rng(self.random_state)
 
         # Early stopping
         es_patience = self.early_stopping_epochs
@@ -166,48 +421,41 @@ class ParametricTSNE(BaseEstimator, TransformerMixin):
 
         # Precompute P (once for all!)
         P = self._calculate_P(X)                
-        
+
+        # Input pipeline, built once: the generator is restarted by every epoch's iterator
+        # and reads the current 'epoch' (late binding) at that point
         epoch = 0
+        dataset = tf.data.Dataset.from_generator(
+            lambda: self._batches(X, P, epoch),
+            output_signature=(tf.TensorSpec((self.batch_size, n_feature), tf.float32),
+                              tf.TensorSpec((self.batch_size, self.batch_size), tf.float32)))
+        dataset = dataset.prefetch(tf.data.AUTOTUNE)
+        # Stage batches on the GPU (if any) so H2D copies overlap with training
+        gpus = tf.config.list_logical_devices('GPU')
+        if gpus:
+            dataset = dataset.apply(tf.data.experimental.prefetch_to_device(gpus[0].name))
+        
         while epoch < self.n_iter and not es_stop:
 
-            # Make copy
-            _P = P.copy()
-
-            ## Shuffle entries
-            # p_idxs = np.random.permutation(self.batch_size)
-    
-            # Early exaggeration        
-            if epoch < self.early_exaggeration_epochs:
-                _P *= self.early_exaggeration_value
-
             # Actual training
             loss = 0.0
             n_batches = 0
-            for i in range(0, n_sample, self.batch_size):
-                
-                batch_slice = slice(i, i + self.batch_size)
-                X_batch, _P_batch = X[batch_slice], _P[batch_slice]
-                
-                # Shuffle entries
-                p_idxs = np.random.permutation(self.batch_size)
-                # Shuffle data
-                X_batch = X_batch[p_idxs]
-                # Shuffle rows and cols of P
-                _P_batch = _P_batch[p_idxs, :]
-                _P_batch = _P_batch[:, p_idxs]
-
-                loss += self._model.train_on_batch(X_batch, _P_batch)
+            for X_batch, P_batch in dataset:
+                loss += self._train_step(X_batch, P_batch)
                 n_batches += 1
             
             # End-of-epoch: summarize
-            loss /= n_batches
+            loss = float(loss) / n_batches
 
             if epoch % 10 == 0:
                 self._log('Epoch: {0} - Loss: {1:.3f}'.format(epoch, loss))
             
-            if callback is not None:
-                # Write log
-                write_log(callback, ['loss'], [loss], epoch)
+            if writer is not None:
+                # Write log (buffered, flushed every 50 epochs)
+                with writer.as_default():
+                    tf.summary.scalar('loss', loss, step=epoch)
+                if epoch % 50 == 0:
+                    writer.flush()
 
             # Check early-stopping condition
             if loss < es_loss and np.abs(loss - es_loss) > self.early_stopping_min_improvement:
@@ -221,9 +469,11 @@ class ParametricTSNE(BaseEstimator, TransformerMixin):
                 es_stop = True
 
             # Going to the next iteration...
-            del _P    
             epoch += 1
 
+        if writer is not None:
+            writer.close()
+
         self._log('Done')
 
         return self  # scikit-learn does so..
@@ -255,27 +505,85 @@ class ParametricTSNE(BaseEstimator, TransformerMixin):
     # ================================ Internals ================================
 
     def _calculate_P(self, X):
+        if self.method == 'knn':
+            return self._calculate_P_knn(X)
+        elif self.method != 'exact':
+            raise ValueError("'method' must be 'exact' or 'knn', got {0!r}".format(self.method))
+
         n = X.shape[0]
-        P = np.zeros([n, self.batch_size])
+        P = np.zeros([n, self.batch_size], dtype=np.float32)
         self._log("Computing P...")
-        for i in tqdm(np.arange(0, n, self.batch_size)):
-            P_batch = x2p(X[i:i + self.batch_size], self.perplexity)
-            P_batch[np.isnan(P_batch)] = 0
-            P_batch = P_batch + P_batch.T
-            P_batch = P_batch / P_batch.sum()
-            P_batch = np.maximum(P_batch, 1e-12)
-            P[i:i + self.batch_size] = P_batch
+        for i in self._batch_range(n):
+            P_batch = x2p(X[i:i + self.batch_size], self.perplexity, use_gpu=self.use_gpu)
+            P[i:i + self.batch_size] = _finalize_P(P_batch)
         return P
 
+    def _calculate_P_knn(self, X):
+        if self.use_gpu:
+            raise ValueError("use_gpu=True is not supported with method='knn'")
+
+        n = X.shape[0]
+        P = []
+        self._log("Computing P (kNN)...")
+        for i in self._batch_range(n):
+            P_batch = x2p_knn(X[i:i + self.batch_size], self.perplexity)
+            P_batch.data[np.isnan(P_batch.data)] = 0
+            P_batch = P_batch + P_batch.T
+            # In place: a sparse true-divide would upcast the data to float64
+            P_batch.data *= np.float32(1.0 / P_batch.sum())
+            P.append(P_batch)
+        return sparse.vstack(P, format='csr', dtype=np.float32)
+
+    def _batches(self, X, P, epoch):
+        """yield shuffled (X, P) training batches for the given epoch"""
+        # All the batch permutations of this epoch, drawn in one shot
+        n_batches = X.shape[0] // self.batch_size
+        perms = self._rng.permuted(np.tile(np.arange(self.batch_size), (n_batches, 1)), axis=1)
+
+        for b, i in enumerate(range(0, X.shape[0], self.batch_size)):
+
+            batch_slice = slice(i, i + self.batch_size)
+            X_batch, P_batch = X[batch_slice], P[batch_slice]
+            if sparse.issparse(P_batch):
+                # Densify the (batch, batch) block, clamped as in the exact path
+                P_batch = P_batch.toarray()
+                np.maximum(P_batch, np.float32(1e-12), out=P_batch)
+
+            # Shuffle entries
+            p_idxs = perms[b]
+            # Shuffle data
+            X_batch = np.take(X_batch, p_idxs, axis=0)
+            # Shuffle rows and cols of P in a single gather (copies, 'P' is left untouched)
+            P_batch = P_batch[np.ix_(p_idxs, p_idxs)]
+
+            # Early exaggeration
+            if epoch < self.early_exaggeration_epochs:
+                P_batch *= self.early_exaggeration_value
+
+            yield X_batch, P_batch
+
+    def _train_on_batch(self, X_batch, P_batch):
+        """single optimization step, compiled by '_build_model' into '_train_step'"""
+        with tf.GradientTape() as tape:
+            Y = self._model(X_batch, training=True)
+            loss = self._kl_divergence(P_batch, Y)
+        grads = tape.gradient(loss, self._model.trainable_variables)
+        self._optimizer.apply_gradients(zip(grads, self._model.trainable_variables))
+
+        return loss
+
     def _kl_divergence(self, P, Y):
         sum_Y = K.sum(K.square(Y), axis=1)
-        eps = K.constant(1e-15)
-        D = sum_Y + K.reshape(sum_Y, [-1, 1]) - 2 * K.dot(Y, K.transpose(Y))
-        Q = K.pow(1 + D / self.alpha, -(self.alpha + 1) / 2)
-        Q *= K.constant(1 - np.eye(self.batch_size))
+        eps = self._eps
+        D = sum_Y + K.reshape(sum_Y, [-1, 1]) - 2 * tf.linalg.matmul(Y, Y, transpose_b=True)
+        if self.alpha == 1:
+            Q = tf.math.reciprocal(1 + D)       # Cauchy kernel, no pow needed
+        else:
+            Q = K.pow(1 + D / self.alpha, -(self.alpha + 1) / 2)
+        Q *= self._eye_mask
         Q /= K.sum(Q)
         Q = K.maximum(Q, eps)
-        C = K.log((P + eps) / (Q + eps))
+        C = tf.math.log(P + eps) - tf.math.log(Q + eps)     # log-difference, XLA fuses both logs
         C = K.sum(P * C)
 
         return C
@@ -287,7 +595,18 @@ class ParametricTSNE(BaseEstimator, TransformerMixin):
         for n in [self.nl1, self.nl2, self.nl3]:
             self._model.add(Dense(n, activation='relu'))
         self._model.add(Dense(n_output, activation='linear'))
-        self._model.compile('adam', self._kl_divergence)
+        # Loss constants, built once instead of at every step
+        self._eye_mask = tf.constant(1 - np.eye(self.batch_size, dtype=np.float32))
+        self._eps = tf.constant(1e-15, dtype=tf.float32)
+        self._optimizer = Adam()
+        self._train_step = tf.function(self._train_on_batch, jit_compile=True)
+
+    def _batch_range(self, n):
+        """batch offsets over n samples, with a throttled progress bar if verbose"""
+        it = range(0, n, self.batch_size)
+        if self.verbose >= 1:
+            it = tqdm(it, miniters=max(1, (n // self.batch_size) // 100), mininterval=0.5)
+        return it
 
     def _log(self, *args, **kwargs):
         """logging with given arguments and keyword arguments"""
@@ -22,6 +22,7 @@ setuptools.setup(
     install_requires=[
         'numpy',
         'numba',
+        'scipy',
         'scikit-learn',
         'tqdm',
         'tensorflow',
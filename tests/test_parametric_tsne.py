@@ -0,0 +1,112 @@
+import os
+import subprocess
+import sys
+
+import numba
+import numpy as np
+import pytest
+
+from msp_tsne.parametric_tsne import ParametricTSNE, x2p, x2p_job, x2p_knn, _x2p_all, squared_distances
+
+
+@pytest.mark.parametrize('n', [13, 21])
+@pytest.mark.parametrize('scale', [1., 255.])  # 255: every exp underflows at beta=1
+def test_x2p_all_matches_x2p_job(n, scale):
+    rng = np.random.default_rng(0)
+    X = (rng.random((n, 5)) * scale).astype(np.float32)
+    D = squared_distances(X)
+    logU = np.float32(np.log(5.))
+
+    P = np.empty_like(D)
+    _x2p_all(D, logU, P)
+
+    P_ref = np.stack([x2p_job((i, D[i], logU))[1] for i in range(n)])
+    assert not np.isnan(P).any()
+    np.testing.assert_allclose(P, P_ref, rtol=1e-3, atol=1e-6)
+
+
+@pytest.mark.parametrize('perplexity', [2., 5., 30.])
+@pytest.mark.parametrize('scale', [1., 255.])
+def test_x2p_rows_reach_target_entropy(perplexity, scale):
+    rng = np.random.default_rng(0)
+    X = (rng.standard_normal((300, 50)) * scale).astype(np.float32)
+
+    P = x2p(X, perplexity)
+
+    assert P.dtype == np.float32
+    np.testing.assert_array_equal(np.diag(P), 0.)
+    np.testing.assert_allclose(P.sum(axis=1), 1., rtol=1e-5)
+    P = P.astype(np.float64)
+    H = -np.sum(P * np.log(np.where(P > 0, P, 1.)), axis=1)
+    np.testing.assert_allclose(H, np.log(perplexity), atol=1e-4)
+
+
+def test_x2p_knn_rows_sum_to_one():
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((100, 10)).astype(np.float32)
+
+    P = x2p_knn(X, 5.)
+
+    assert P.shape == (100, 100)
+    np.testing.assert_array_equal(np.diff(P.indptr), 15)       # 3 * perplexity neighbors
+    np.testing.assert_array_equal(P.diagonal(), 0.)
+    np.testing.assert_allclose(np.asarray(P.sum(axis=1)).ravel(), 1., rtol=1e-5)
+
+
+def test_knn_P_blocks_and_batches():
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((150, 10)).astype(np.float32)
+    tsne = ParametricTSNE(perplexity=5., batch_size=50, method='knn', random_state=0)
+    tsne._rng = np.random.default_rng(0)
+
+    P = tsne._calculate_P(X)
+
+    assert P.shape == (150, 50)
+    assert P.dtype == np.float32
+    for i in range(0, 150, 50):
+        P_block = P[i:i + 50].toarray()
+        np.testing.assert_allclose(P_block, P_block.T)
+        np.testing.assert_allclose(P_block.sum(), 1., rtol=1e-5)
+
+    batches = list(tsne._batches(X, P, epoch=tsne.early_exaggeration_epochs))
+    assert len(batches) == 3
+    for i, (X_batch, P_batch) in zip(range(0, 150, 50), batches):
+        assert P_batch.shape == (50, 50)
+        assert P_batch.dtype == np.float32
+        assert P_batch.min() >= np.float32(1e-12)
+        # Shuffled version of the clamped dense block
+        P_block = np.maximum(P[i:i + 50].toarray(), np.float32(1e-12))
+        np.testing.assert_array_equal(np.sort(P_batch, axis=None), np.sort(P_block, axis=None))
+        np.testing.assert_array_equal(np.sort(X_batch, axis=0), np.sort(X[i:i + 50], axis=0))
+
+
+@pytest.mark.parametrize('n_jobs', [None, 1, -1])
+def test_x2p_restores_numba_thread_count(n_jobs):
+    X = np.random.default_rng(0).standard_normal((20, 5)).astype(np.float32)
+    n_threads = numba.get_num_threads()
+
+    x2p(X, 5., n_jobs=n_jobs)
+    x2p_knn(X, 5., n_jobs=n_jobs)
+
+    assert numba.get_num_threads() == n_threads
+
+
+_CUDASIM_SCRIPT = """
+import numpy as np
+from msp_tsne.parametric_tsne import d2p, squared_distances
+for scale in (1., 255.):
+    X = (np.random.default_rng(0).random((12, 5)) * scale).astype(np.float32)
+    D = squared_distances(X)
+    print(np.abs(d2p(D, 3., use_gpu=True) - d2p(D, 3.)).max())
+"""
+
+
+def test_x2p_gpu_matches_cpu_on_cuda_simulator():
+    # NUMBA_ENABLE_CUDASIM is read when numba is imported: run in a fresh interpreter
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, NUMBA_ENABLE_CUDASIM='1', PYTHONPATH=root)
+    out = subprocess.run([sys.executable, '-c', _CUDASIM_SCRIPT], env=env, cwd=root,
+                         capture_output=True, text=True, check=True).stdout
+    max_diffs = [float(line) for line in out.split()]
+    assert len(max_diffs) == 2
+    assert max(max_diffs) <= 1e-6